@@ -1,26 +1,86 @@
 # scripts/process_excel.py
 
 import os
+import sys
 import time
+import queue
+import atexit
+import random
+import asyncio
 import logging
+import hashlib
+from logging.handlers import QueueHandler, QueueListener
 import yaml
+import httpx
+import numpy as np
 import pandas as pd
-import openai
+import tiktoken
+import diskcache
+from openai import AsyncOpenAI, APIConnectionError, BadRequestError, RateLimitError
 from pathlib import Path
-from typing import Any, Dict, Optional, List
-from openpyxl import load_workbook
+from typing import Any, Callable, Dict, Optional, List, Sequence, Tuple
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter as column_index_to_letter
+import re
 import json
+import orjson
 import operator
+from functools import partial, reduce
+
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 # ---------------------------- Logging Configuration ---------------------------- #
 
+class BufferedFileHandler(logging.StreamHandler):
+    """
+    Append records to a file through a 64 KB buffer that is only written out when it fills
+    up and when the handler is closed, instead of flushing after every record.
+    """
+    def __init__(self, filename: str, buffer_size: int = 65536):
+        super().__init__(open(filename, 'a', buffering=buffer_size, encoding='utf-8'))
+
+    def flush(self):
+        pass  # StreamHandler.emit flushes after every record; let the buffer fill instead
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream and not self.stream.closed:
+                self.stream.flush()
+                self.stream.close()
+        finally:
+            self.release()
+        super().close()
+
+def stop_logging():
+    # Drain the queue first, then write out and close the buffered file
+    log_listener.stop()
+    log_file_handler.close()
+
+# Records are handed to a background thread that writes them through a buffered file,
+# so logging from the event loop never waits on disk I/O. Records still in the buffer
+# are lost if the process is killed outright.
+log_queue = queue.Queue(-1)
+log_file_handler = BufferedFileHandler('../log_file.log')
+log_file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+log_listener = QueueListener(
+    log_queue,
+    log_file_handler,
+    #logging.StreamHandler(),  # Added to also output logs to the console
+    respect_handler_level=True
+)
+log_listener.start()
+atexit.register(stop_logging)
+
+# The queue handler only merges the message arguments; the file handler adds the timestamp
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler('../log_file.log'),
-        #logging.StreamHandler()  # Added to also output logs to the console
-    ]
+    format="%(message)s",
+    handlers=[QueueHandler(log_queue)]
 )
 
 logger = logging.getLogger(__name__)
@@ -30,49 +90,420 @@ logger = logging.getLogger(__name__)
 def load_config(config_path: str) -> Dict[str, Any]:
     try:
         with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
+            config = yaml.load(file, Loader=YamlLoader)
         logger.info(f"Configuration loaded from {config_path}")
         return config
     except Exception as e:
         logger.error(f"Failed to load configuration file: {e}")
         raise
 
+# ---------------------------- Rate Limiter ---------------------------- #
+
+class RateLimiter:
+    """
+    Token-bucket limiter for the account's requests-per-minute and tokens-per-minute limits.
+
+    Capacity refills continuously, so callers only wait when the bucket cannot cover the
+    next request. Rate limit errors drain the bucket and pause all callers with an
+    exponential backoff.
+    """
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = float(max_requests_per_minute)
+        self.available_token_capacity = float(max_tokens_per_minute)
+        self.last_update_time = time.monotonic()
+        self.paused_until = 0.0
+        self.rate_limit_errors = 0
+        logger.info(f"Rate limiter initialized with {max_requests_per_minute} requests/min and {max_tokens_per_minute} tokens/min.")
+
+    def _replenish(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        self.available_request_capacity = min(
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60.0,
+            self.max_requests_per_minute
+        )
+        self.available_token_capacity = min(
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60.0,
+            self.max_tokens_per_minute
+        )
+
+    async def acquire(self, requests: int = 1, tokens: int = 0):
+        # A single request larger than the bucket could otherwise never be served
+        tokens = min(tokens, self.max_tokens_per_minute)
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self._replenish()
+            if self.available_request_capacity >= requests and self.available_token_capacity >= tokens:
+                self.available_request_capacity -= requests
+                self.available_token_capacity -= tokens
+                return
+
+            # Sleep only as long as it takes for the missing capacity to refill
+            wait_time = max(
+                (requests - self.available_request_capacity) * 60.0 / self.max_requests_per_minute,
+                (tokens - self.available_token_capacity) * 60.0 / self.max_tokens_per_minute,
+                0.001
+            )
+            await asyncio.sleep(wait_time)
+
+    def record_success(self):
+        self.rate_limit_errors = 0
+
+    def record_rate_limit_error(self, retry_after: Optional[float] = None):
+        # Prefer the server's own Retry-After hint over the exponential guess
+        self.rate_limit_errors += 1
+        self._replenish()
+        self.available_request_capacity /= 2
+        self.available_token_capacity /= 2
+        backoff = retry_after if retry_after is not None else min(2 ** self.rate_limit_errors, 60)
+        self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+        logger.warning(f"Rate limit hit ({self.rate_limit_errors} in a row). Pausing requests for {backoff} seconds.")
+
 # ---------------------------- OpenAI API Client ---------------------------- #
 
+# Context window sizes used to keep max_tokens within what the model can return.
+# Matched by longest prefix, so dated snapshots (e.g. 'gpt-4o-2024-08-06') resolve too.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+def context_window_for(model: str) -> int:
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+def retry_after_seconds(response: Optional[httpx.Response]) -> Optional[float]:
+    """Return the wait requested by a 429 response's Retry-After headers, if any."""
+    if response is None:
+        return None
+    retry_after_ms = response.headers.get("retry-after-ms")
+    retry_after = response.headers.get("retry-after")
+    try:
+        if retry_after_ms is not None:
+            return max(float(retry_after_ms) / 1000.0, 0.0)
+        if retry_after is not None:
+            return max(float(retry_after), 0.0)
+    except ValueError:
+        logger.debug(f"Ignoring unparseable Retry-After header: {retry_after_ms or retry_after}")
+    return None
+
+class SemanticCache:
+    """
+    Cache that answers a request with the result of the most similar earlier request.
+
+    Entries are grouped by namespace (everything about a request except the row's input
+    values), so only requests for the same column, model and settings are compared.
+    Embeddings are L2-normalized, making the dot product their cosine similarity.
+    """
+    def __init__(self, path: Path, threshold: float = 0.93, model: str = "text-embedding-3-small"):
+        self.path = path
+        self.threshold = threshold
+        self.model = model
+        self.embeddings = {}
+        self.values = {}
+        self.hits = 0
+
+        embeddings_path = self.path / "embeddings.npz"
+        values_path = self.path / "values.json"
+        if embeddings_path.exists() and values_path.exists():
+            with np.load(embeddings_path) as data:
+                self.embeddings = {namespace: data[namespace] for namespace in data.files}
+            self.values = orjson.loads(values_path.read_bytes())
+        entries = sum(len(values) for values in self.values.values())
+        logger.info(f"Semantic cache opened at '{self.path}' with {entries} entries.")
+
+    def lookup(self, namespace: str, embedding: np.ndarray) -> Optional[Any]:
+        matrix = self.embeddings.get(namespace)
+        if matrix is None or matrix.shape[1] != embedding.shape[0]:
+            # Vectors of another size come from a different embedding model and cannot match
+            return None
+        similarities = matrix @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None
+        self.hits += 1
+        return self.values[namespace][best]
+
+    def add(self, namespace: str, embedding: np.ndarray, value: Any):
+        matrix = self.embeddings.get(namespace)
+        if matrix is None or matrix.shape[1] != embedding.shape[0]:
+            self.embeddings[namespace] = embedding[np.newaxis]
+            self.values[namespace] = [value]
+            return
+        self.embeddings[namespace] = np.vstack([matrix, embedding])
+        self.values[namespace].append(value)
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        np.savez(self.path / "embeddings.npz", **self.embeddings)
+        (self.path / "values.json").write_bytes(orjson.dumps(self.values))
+
 class OpenAIClient:
-    def __init__(self, api_key: str, model: str, system_message: str):
-        openai.api_key = api_key  # Set the API key
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        system_message: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        cache: Optional[diskcache.Cache] = None,
+        context_window: Optional[int] = None,
+        cache_sampled: bool = False,
+        semantic_cache: Optional[SemanticCache] = None
+    ):
+        # Share one pooled HTTP/2 client for the whole run, so concurrent requests are
+        # multiplexed over kept-alive connections instead of each paying a TLS handshake
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+        # Retries are handled by ExcelProcessor.request_value, so every attempt goes through
+        # the rate limiter instead of being repeated inside the SDK
+        self.client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, max_retries=0)
         self.model = model
         self.system_message = system_message
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.cache_sampled = cache_sampled
+        self.semantic_cache = semantic_cache
+        self.context_window = context_window
+        self.requests = {}
+        self.deduplicated_requests = 0
+
+        # Tokenizer used to size max_tokens and estimate each request's cost for the rate limiter.
+        # tiktoken downloads its encodings on first use; without network access the counts fall
+        # back to a rough estimate, which is all the limiter and the token budget need.
+        try:
+            try:
+                self.encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(f"Could not load a tiktoken encoding ({e}); estimating token counts as 4 characters per token.")
+            self.encoding = None
+        self.system_message_tokens = self.count_tokens(self.system_message)
         logger.info(f"OpenAI client initialized with model '{self.model}' and system message: '{self.system_message}'.")
 
-    def create_completion(
+    async def close(self):
+        await self.client.close()
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Return the normalized embedding of a text, or None if it could not be created."""
+        try:
+            response = await self.client.embeddings.create(model=self.semantic_cache.model, input=text)
+        except Exception as e:
+            logger.warning(f"Could not embed text for the semantic cache: {e}")
+            return None
+        embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is None:
+            return len(text) // 4 + 1
+        # Count special-token text such as '<|endoftext|>' as plain text instead of raising
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count_prompt_tokens(self, prompt: str, context: Optional[str] = None) -> int:
+        tokens = self.system_message_tokens + self.count_tokens(prompt)
+        if context:
+            tokens += self.count_tokens(context)
+        return tokens
+
+    def cache_key(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        functions: Optional[List[Dict]],
+        context: Optional[str],
+        response_format: Optional[Dict] = None,
+        model: Optional[str] = None,
+        seed: Optional[int] = None
+    ) -> str:
+        key_fields = {
+            'model': model or self.model,
+            'system_message': self.system_message,
+            'prompt': prompt,
+            'context': context,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'functions': functions,
+            'response_format': response_format
+        }
+        if seed is not None:
+            key_fields['seed'] = seed
+        key_data = json.dumps(key_fields, sort_keys=True)
+        return hashlib.blake2b(key_data.encode()).hexdigest()
+
+    async def create_completion(
         self,
         prompt: str,
         max_tokens: int,
         temperature: float,
         functions: Optional[List[Dict]] = None,
-        function_call: Optional[Dict] = None
+        function_call: Optional[Dict] = None,
+        context: Optional[str] = None,
+        response_format: Optional[Dict] = None,
+        max_tokens_cap: Optional[int] = None,
+        model: Optional[str] = None,
+        seed: Optional[int] = None
     ) -> Optional[Any]:
+        """
+        Return the completion for a prompt, serving repeated requests from the response cache.
+
+        Responses sampled with a temperature above 0 are only cached when 'cache_sampled' is set.
+        On an exact cache miss, the semantic cache (if configured) may answer with the result
+        of a sufficiently similar earlier request.
+        A response truncated at 'max_tokens' is retried once with a 1.5x larger budget,
+        up to 'max_tokens_cap'. 'model' overrides the client's default model for this call, and
+        'seed' asks OpenAI for reproducible sampling.
+        """
+        model = model or self.model
+        request_args = dict(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            functions=functions,
+            function_call=function_call,
+            context=context,
+            response_format=response_format,
+            max_tokens_cap=max_tokens_cap,
+            model=model,
+            seed=seed
+        )
+        key = self.cache_key(prompt, max_tokens, temperature, functions, context, response_format, model, seed)
+        cacheable = temperature == 0 or self.cache_sampled
+        if cacheable and self.cache is not None:
+            result = self.cache.get(key)
+            if result is not None:
+                logger.debug("Cache hit for key %s", key)
+                return result
+
+        # Identical requests within a run share a single API call, whether they are
+        # in flight at the same time or come after the first one has completed
+        task = self.requests.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request_and_cache(key, request_args, cacheable))
+            self.requests[key] = task
+        else:
+            self.deduplicated_requests += 1
+            logger.debug("Sharing the response of an identical request for key %s", key)
+
         try:
-            # Prepare the messages
+            # Shield the shared request so one cancelled caller does not cancel it for the others
+            result = await asyncio.shield(task)
+        except Exception:
+            self._forget_request(key, task)
+            raise
+        if not result:
+            # Let retries issue a fresh request instead of reusing an empty response
+            self._forget_request(key, task)
+        return result
+
+    async def _request_and_cache(self, key: str, request_args: Dict[str, Any], cacheable: bool) -> Optional[Any]:
+        embedding = None
+        if cacheable and self.semantic_cache is not None:
+            # Rows are compared by their input values; everything else, including the
+            # embedding model that produced the vectors, must match exactly
+            request_key = self.cache_key(
+                request_args['prompt'], request_args['max_tokens'], request_args['temperature'],
+                request_args['functions'], None, request_args['response_format'], request_args['model'],
+                request_args['seed']
+            )
+            namespace = hashlib.blake2b(f"{self.semantic_cache.model}|{request_key}".encode()).hexdigest()
+            embedding = await self.embed(request_args['context'] or request_args['prompt'])
+            if embedding is not None:
+                result = self.semantic_cache.lookup(namespace, embedding)
+                if result is not None:
+                    logger.debug("Semantic cache hit for key %s", key)
+                    return result
+
+        result = await self._request_completion(**request_args)
+        if result and cacheable:
+            if self.cache is not None:
+                self.cache.set(key, result)
+            if embedding is not None:
+                self.semantic_cache.add(namespace, embedding, result)
+        return result
+
+    def _forget_request(self, key: str, task: asyncio.Future):
+        if self.requests.get(key) is task:
+            del self.requests[key]
+
+    async def _request_completion(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        functions: Optional[List[Dict]],
+        function_call: Optional[Dict],
+        context: Optional[str],
+        response_format: Optional[Dict],
+        max_tokens_cap: Optional[int],
+        model: str,
+        seed: Optional[int]
+    ) -> Optional[Any]:
+        try:
+            # Prepare the messages. The system message and prompt template are identical
+            # across rows and come first, so they form a stable prefix for OpenAI's
+            # prompt caching; only the trailing context message varies per row.
             messages = [
                 {"role": "system", "content": self.system_message},
                 {"role": "user", "content": prompt}
             ]
+            if context:
+                messages.append({"role": "user", "content": context})
 
-            # Create the completion
-            completion = openai.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                functions=functions,
-                function_call=function_call
-            )
-            logger.debug("\nCompletion is:")
-            logger.debug(completion)
-            logger.debug("\n")
+            # Size the output budget so prompt plus completion fit in the context window
+            prompt_tokens = self.count_prompt_tokens(prompt, context)
+            context_window = self.context_window or context_window_for(model)
+            available_tokens = max(context_window - prompt_tokens - 64, 1)
+            budget = min(max_tokens, available_tokens)
+            budget_cap = min(max(max_tokens_cap or max_tokens, budget), available_tokens)
+
+            # Only send response_format when requested; JSON mode requires the prompt to ask for JSON
+            extra_args = {"response_format": response_format} if response_format else {}
+            if seed is not None:
+                extra_args["seed"] = seed
+
+            retried_truncation = False
+            while True:
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire(1, prompt_tokens + budget)
+
+                # Create the completion
+                completion = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=budget,
+                    temperature=temperature,
+                    functions=functions,
+                    function_call=function_call,
+                    **extra_args
+                )
+                if self.rate_limiter:
+                    self.rate_limiter.record_success()
+                logger.debug("Completion is: %s", completion)
+
+                if completion.choices[0].finish_reason != "length" or retried_truncation or budget >= budget_cap:
+                    break
+                retried_truncation = True
+                budget = min(max(int(budget * 1.5), budget + 1), budget_cap)
+                logger.info(f"Response was truncated by max_tokens; retrying once with a budget of {budget} tokens.")
 
             # Handle the response
             message = completion.choices[0].message
@@ -80,38 +511,83 @@ class OpenAIClient:
             if hasattr(message, 'function_call') and message.function_call:
                 # Extract the arguments from the function call
                 arguments_str = message.function_call.arguments
-                arguments = json.loads(arguments_str)
+                arguments = orjson.loads(arguments_str)
                 return arguments
             else:
                 content = message.content.strip() if message.content else ''
-                logger.debug(f"OpenAI response content: {content}")
+                logger.debug("OpenAI response content: %s", content)
                 return content
 
-        except Exception as e:
-            logger.error(f"OpenAI API request failed: {e}")
-            return None
+        except RateLimitError as e:
+            # Failures are logged once by the caller, which knows the row and column
+            if self.rate_limiter:
+                self.rate_limiter.record_rate_limit_error(retry_after_seconds(e.response))
+            raise
 
 # ---------------------------- Excel Processor ---------------------------- #
 
+def format_context(template: str, row_values: Sequence[Any], positions: List[int]) -> str:
+    """
+    Fill a context template with the row's values at the given input column positions.
+    """
+    return template.format(*[row_values[position] for position in positions])
+
+def build_row_contexts(
+    row: pd.Series,
+    context_templates: Dict[str, str],
+    input_positions: Dict[str, List[int]]
+) -> Dict[str, str]:
+    """
+    Fill every output column's context template from one row.
+
+    Kept free of processor state so it can be shipped to pandarallel worker processes.
+    """
+    row_values = row.tolist()
+    return {
+        output_column: format_context(template, row_values, input_positions[output_column])
+        for output_column, template in context_templates.items()
+    }
+
 class ExcelProcessor:
     def __init__(self, config: Dict[str, Any], openai_client: OpenAIClient):
         self.config = config
         self.openai = openai_client
         self.input_path = config['excel']['input_path']
         self.sheet_name = config['excel'].get('sheet_name', 'Sheet1')
+        self.output_path = config['excel'].get('output_path')
+        self.read_engine = config['excel'].get('read_engine', 'openpyxl')
+        self.write_engine = config['excel'].get('write_engine', 'openpyxl')
+        # A restarted run with a separate output file resumes from the results saved there
+        self.read_path = self.output_path if self.output_path and os.path.exists(self.output_path) else self.input_path
         self.output_columns = config['columns']['output']
-        self.sleep_time = config['processing'].get('sleep_time', 1)
         self.retry_attempts = config['processing'].get('retry_attempts', 3)
         self.retry_delay = config['processing'].get('retry_delay', 5)
+        self.max_concurrency = config['processing'].get('max_concurrency', 5)
+        self.batch_size = config['processing'].get('batch_size', 1)
+        self.checkpoint_interval = config['processing'].get('checkpoint_interval', 100)
+        self.pending_results = {}
+        self.parallel_workers = config['processing'].get('parallel_workers', 0)
+        self.combine_columns = config['processing'].get('combine_columns', False)
+        self.row_contexts = {}
 
-        # Load the workbook once to keep it open during processing
-        try:
-            self.workbook = load_workbook(filename=self.input_path)
-            self.sheet = self.workbook[self.sheet_name]
-            logger.info(f"Workbook '{self.input_path}' loaded successfully.")
-        except Exception as e:
-            logger.error(f"Failed to load workbook '{self.input_path}': {e}")
-            raise
+        # Optional model cascade: values failing their column's validation are
+        # requested again from the stronger model
+        self.strong_model = config.get('openai', {}).get('models', {}).get('strong')
+        self.validated_values = 0
+        self.promoted_values = 0
+
+        # Read the sheet values once for processing; rows are handed around as raw value
+        # tuples, read by position through these headers rather than as per-row Series
+        self.df = self.load_excel()
+        self._headers = tuple(self.df.columns)
+        self._header_index = {header: position for position, header in enumerate(self._headers)}
+
+        # Input columns used by any output, in first-seen order, for the per-row log line
+        self.input_columns = list(dict.fromkeys(
+            input_col
+            for output_config in self.output_columns.values()
+            for input_col in output_config.get('input_columns', [])
+        ))
 
         # Load filter configuration
         self.filter_enabled = config.get('filter', {}).get('enabled', False)
@@ -122,202 +598,909 @@ class ExcelProcessor:
         else:
             logger.info("Filtering is disabled. All rows will be processed.")
 
+        # Fail before any request is paid for if a configured column is not in the sheet
+        self.validate_columns()
+
+        # When updating the input file in place, results are written through an editable
+        # workbook that is only loaded once there is something to write (see open_workbook).
+        # A separate output file is streamed from self.df instead.
+        self.workbook = None
+        self.sheet = None
+
+        # Map header names to column letters once; the first matching header wins
+        self._col_letters = {}
+        for position, header in enumerate(self._headers, start=1):
+            if header is not None:
+                self._col_letters.setdefault(header, column_index_to_letter(position))
+
+        # Precompile each output column's row context into a str.format template, so
+        # building it per row is a single format call instead of repeated concatenation
+        self._context_templates = {
+            output_column: self.context_template(output_config.get('input_columns', []))
+            for output_column, output_config in self.output_columns.items()
+        }
+
+        # Positions of each output column's input values in a raw row tuple, so contexts are
+        # formatted straight from the sheet's values
+        self._input_positions = {
+            output_column: [self._header_index[input_col] for input_col in output_config.get('input_columns', [])]
+            for output_column, output_config in self.output_columns.items()
+        }
+
+        # Resolve each output column's settings and function definition once instead of per request
+        self._compiled = {
+            output_column: self.compile_output_column(output_column, output_config)
+            for output_column, output_config in self.output_columns.items()
+        }
+        self._combined = {}
+
+    def validate_columns(self):
+        """
+        Check that every configured input, output and filter column exists in the sheet.
+        """
+        headers = set(self._headers)
+        missing = [column for column in self.input_columns if column not in headers]
+        missing += [column for column in self.output_columns if column not in headers]
+        if self.filter_enabled:
+            missing += [criterion.get('column') for criterion in self.filter_criteria if criterion.get('column') not in headers]
+        if missing:
+            missing = list(dict.fromkeys(missing))
+            logger.error(f"Columns {missing} not found in sheet '{self.sheet_name}' of '{self.read_path}'.")
+            raise ValueError(f"Columns {missing} not found in sheet '{self.sheet_name}' of '{self.read_path}'.")
+
+    def load_excel(self) -> pd.DataFrame:
+        """
+        Stream the sheet's cell values into a DataFrame using a read-only workbook.
+
+        Read-only mode parses rows lazily instead of building the full cell and style
+        graph, which keeps load time and memory low on large sheets. Formula cells are read
+        as their formula text, so output cells holding a formula count as populated and are
+        never overwritten. With 'read_engine' set to 'calamine', the sheet is parsed by
+        python-calamine instead.
+        """
+        try:
+            if self.read_engine == 'calamine':
+                header, rows = self.read_rows_calamine()
+            else:
+                workbook = load_workbook(filename=self.read_path, read_only=True)
+                try:
+                    rows = workbook[self.sheet_name].iter_rows(values_only=True)
+                    header = next(rows, ())
+                    rows = list(rows)
+                finally:
+                    workbook.close()
+            df = pd.DataFrame(rows, columns=list(header), dtype=object)
+            logger.info(f"Read {len(df)} rows from sheet '{self.sheet_name}' of '{self.read_path}'.")
+            return df
+        except Exception as e:
+            logger.error(f"Failed to read workbook '{self.read_path}': {e}")
+            raise
+
+    def read_rows_calamine(self) -> Tuple[List[Any], List[List[Any]]]:
+        from python_calamine import CalamineWorkbook  # Optional dependency, only needed for read_engine: calamine
+
+        sheet = CalamineWorkbook.from_path(self.read_path).get_sheet_by_name(self.sheet_name)
+        # Keep leading empty rows and columns so cells stay at their Excel positions, and
+        # report empty cells as None like openpyxl does
+        values = [
+            [None if value == '' else value for value in row]
+            for row in sheet.to_python(skip_empty_area=False)
+        ]
+        return (values[0], values[1:]) if values else ([], [])
+
+    @staticmethod
+    def save_atomically(workbook: Workbook, path: str):
+        # Save next to the target and swap it in, so a crash mid-save never truncates the file
+        temp_path = f"{path}.tmp"
+        workbook.save(temp_path)
+        os.replace(temp_path, path)
+
+    def save(self):
+        if self.output_path:
+            self.save_excel()
+        else:
+            self.save_workbook()
+
+    def save_excel(self):
+        """
+        Stream the processed sheet to 'output_path' with a write-only workbook.
+
+        Rows are serialized one at a time without keeping a cell object graph in memory.
+        With 'write_engine' set to 'xlsxwriter', xlsxwriter's constant memory mode is used instead.
+        """
+        try:
+            if self.write_engine == 'xlsxwriter':
+                self.save_excel_xlsxwriter()
+            else:
+                workbook = Workbook(write_only=True)
+                sheet = workbook.create_sheet(self.sheet_name)
+                sheet.append(list(self.df.columns))
+                for row in self.df.itertuples(index=False, name=None):
+                    sheet.append(row)
+                self.save_atomically(workbook, self.output_path)
+            logger.info(f"Workbook '{self.output_path}' saved successfully.")
+        except Exception as e:
+            logger.error(f"Failed to save workbook '{self.output_path}': {e}")
+            raise
+
+    def open_workbook(self):
+        """
+        Load the editable workbook on first use and keep it open for later writes.
+
+        Parsing a full workbook builds every cell and style object, so it is delayed
+        until the first results are written, and skipped when a run writes nothing.
+        """
+        if self.workbook is not None:
+            return
+        try:
+            self.workbook = load_workbook(filename=self.input_path)
+            self.sheet = self.workbook[self.sheet_name]
+            logger.info(f"Workbook '{self.input_path}' loaded successfully.")
+        except Exception as e:
+            logger.error(f"Failed to load workbook '{self.input_path}': {e}")
+            raise
+
+    def save_excel_xlsxwriter(self):
+        import xlsxwriter  # Optional dependency, only needed for write_engine: xlsxwriter
+
+        # Like save_atomically, write next to the target and swap it in once complete
+        temp_path = f"{self.output_path}.tmp"
+        workbook = xlsxwriter.Workbook(temp_path, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+        })
+        sheet = workbook.add_worksheet(self.sheet_name)
+        sheet.write_row(0, 0, list(self.df.columns))
+        for row_index, row in enumerate(self.df.itertuples(index=False, name=None), start=1):
+            sheet.write_row(row_index, 0, row)
+        workbook.close()
+        os.replace(temp_path, self.output_path)
+
     def save_workbook(self):
+        if self.workbook is None:
+            logger.info(f"No results were written, leaving '{self.input_path}' unchanged.")
+            return
         try:
-            self.workbook.save(self.input_path)
+            self.save_atomically(self.workbook, self.input_path)
             logger.info(f"Workbook '{self.input_path}' saved successfully.")
         except Exception as e:
             logger.error(f"Failed to save workbook '{self.input_path}': {e}")
             raise
 
-    def matches_criteria(self, row_data: pd.Series) -> bool:
+    # Mapping of filter operations to actual Python functions, applied to non-empty cells
+    FILTER_OPERATIONS = {
+        "equals": operator.eq,
+        "contains": lambda a, b: b in a if isinstance(a, str) else False,
+        "in": lambda a, b: a in b if a else False,
+        "greater_than": operator.gt,
+        "less_than": operator.lt,
+        # Add more operations as needed
+    }
+
+    @classmethod
+    def compile_criterion(cls, operation: str, value: Any) -> Callable[[Any], bool]:
+        """
+        Build the predicate that matches a single cell value against one filter criterion.
+
+        The operation is resolved once instead of per cell. Empty cells, and cells that
+        cannot be compared with 'value', never match.
         """
-        Determine if a row matches all the filter criteria.
+        op_func = cls.FILTER_OPERATIONS[operation]
+        if operation == "in":
+            try:
+                value = frozenset(value)  # Constant-time membership instead of scanning the list
+            except TypeError:
+                pass  # Unhashable entries; keep the list
+
+        def predicate(cell_value: Any) -> bool:
+            # Handle None or empty (NaN) cell values
+            if cell_value is None or (isinstance(cell_value, float) and cell_value != cell_value):
+                return False
+            try:
+                return bool(op_func(cell_value, value))
+            except Exception:
+                return False
+
+        return predicate
+
+    @staticmethod
+    def criterion_mask(series: pd.Series, operation: str, value: Any) -> pd.Series:
         """
+        Evaluate one filter criterion over a whole column with vectorized pandas operations.
+
+        Empty cells never match. Raises TypeError or AttributeError when the column's values
+        cannot be compared with 'value' in bulk.
+        """
+        present = series.notna()
+        values = series[present]
+        if operation == "equals":
+            matched = values == value
+        elif operation == "contains":
+            matched = values.str.contains(value, regex=False, na=False)
+        elif operation == "in":
+            matched = values.isin(value) & values.astype(bool)
+        elif operation == "greater_than":
+            matched = values > value
+        else:
+            matched = values < value
+
+        mask = pd.Series(False, index=series.index)
+        mask[present] = matched.astype(bool)
+        return mask
+
+    def build_filter_mask(self) -> pd.Series:
+        """
+        Determine which rows match all the filter criteria, as one boolean mask over the sheet.
+        """
+        mask = pd.Series(True, index=self.df.index)
         if not self.filter_enabled or not self.filter_criteria:
-            return True  # No filtering applied
-
-        # Mapping of operations to actual Python functions
-        ops = {
-            "equals": operator.eq,
-            "contains": lambda a, b: b in a if isinstance(a, str) else False,
-            "in": lambda a, b: a in b if a else False,
-            "greater_than": operator.gt,
-            "less_than": operator.lt,
-            # Add more operations as needed
-        }
+            return mask  # No filtering applied
 
         for criterion in self.filter_criteria:
             column = criterion.get('column')
             operation = criterion.get('operation')
             value = criterion.get('value')
 
-            if column not in row_data:
-                logger.warning(f"Filter column '{column}' not found in row data.")
-                return False
+            if column not in self.df.columns:
+                logger.warning(f"Filter column '{column}' not found in the Excel sheet.")
+                return pd.Series(False, index=self.df.index)
+            if operation not in self.FILTER_OPERATIONS:
+                logger.warning(f"Unsupported operation '{operation}' in filter criteria.")
+                return pd.Series(False, index=self.df.index)
+            if operation == "in" and not isinstance(value, list):
+                logger.warning(f"Value for 'in' operation must be a list. Got: {value}")
+                return pd.Series(False, index=self.df.index)
 
-            cell_value = row_data[column]
+            series = self.df[column]
+            try:
+                criterion_mask = self.criterion_mask(series, operation, value)
+            except (TypeError, AttributeError) as e:
+                # Mixed cell types cannot be compared in bulk; compare them one by one instead,
+                # treating cells that cannot be compared as not matching
+                logger.debug("Filtering on column '%s' cell by cell: %s", column, e)
+                criterion_mask = series.map(self.compile_criterion(operation, value)).astype(bool)
+            mask &= criterion_mask
+            logger.debug("Filtering on column '%s': %s %s matched %d rows", column, operation, value, int(criterion_mask.sum()))
 
-            # Handle None or empty cell values
-            if pd.isna(cell_value):
-                cell_value = None
+        return mask
 
-            # Get the operation function
-            op_func = ops.get(operation)
-            if not op_func:
-                logger.warning(f"Unsupported operation '{operation}' in filter criteria.")
-                return False
+    def build_fetch_masks(self) -> Dict[str, pd.Series]:
+        """
+        Compute, per output column, which rows still need a value.
 
-            # Apply the operation
-            try:
-                if operation == "in":
-                    if not isinstance(value, list):
-                        logger.warning(f"Value for 'in' operation must be a list. Got: {value}")
-                        return False
-                    if not op_func(cell_value, value):
-                        return False
+        A row needs a value when 'fetch_all' is set or its cell is empty; evaluating this on
+        whole columns up front lets already-populated rows skip the processing loop entirely.
+        """
+        fetch_masks = {}
+        for output_column, output_config in self.output_columns.items():
+            if output_config.get('fetch_all', False) or output_column not in self.df.columns:
+                fetch_masks[output_column] = pd.Series(True, index=self.df.index)
+            else:
+                current_values = self.df[output_column]
+                fetch_masks[output_column] = current_values.isna() | current_values.astype(str).str.strip().eq('')
+        return fetch_masks
+
+    def should_fetch(self, row_number: int, output_column: str) -> bool:
+        if self.fetch_masks[output_column].iat[row_number - 2]:
+            return True
+        logger.info("Skipping '%s' for row %d as it is already populated and 'fetch_all' is False.", output_column, row_number)
+        return False
+
+    @staticmethod
+    def context_template(input_columns: List[str]) -> str:
+        return "\n".join(
+            str(input_col).replace('{', '{{').replace('}', '}}') + ": {}"
+            for input_col in input_columns
+        )
+
+    # Seed sent with classification requests, so repeated runs sample the same answers
+    CLASSIFICATION_SEED = 42
+
+    @classmethod
+    def compile_output_column(cls, output_column: str, output_config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Resolve an output column's request settings, function definition and first parameter.
+
+        Columns whose schema only has enum properties are classifications, so they are requested
+        with temperature 0 and a fixed seed: their answers stay stable and cacheable across runs.
+        """
+        schema = output_config.get('schema', None)
+        compiled = {
+            "prompt": output_config['prompt'],
+            "max_tokens": output_config.get('max_tokens', 50),
+            "max_tokens_cap": output_config.get('max_tokens_cap'),
+            "temperature": output_config.get('temperature', 0.7),
+            "schema": schema,
+            "functions": None,
+            "function_call": None,
+            "param_name": None,
+            "enum": None,
+            "seed": None,
+            "batch_item_format": 'Each object must have a single "value" key holding the answer.'
+        }
+        if schema:
+            function_name = schema.get('name', 'auto_generated_function')
+            function_schema = schema.get('schema')
+            compiled["functions"] = [{
+                "name": function_name,
+                "parameters": function_schema
+            }]
+            compiled["function_call"] = {"name": function_name}
+            compiled["batch_item_format"] = f"Each object must match this JSON schema: {json.dumps(schema.get('schema', {}))}"
+
+            # Assuming we're interested in the first parameter
+            properties = schema.get('schema', {}).get('properties', {})
+            if properties:
+                compiled["param_name"] = next(iter(properties))
+                compiled["enum"] = next(iter(properties.values())).get('enum')
+
+            if properties and all('enum' in prop for prop in properties.values()):
+                if compiled["temperature"] != 0:
+                    logger.info(f"'{output_column}' only has enum properties; using temperature 0 instead of {compiled['temperature']}.")
+                compiled["temperature"] = 0
+                compiled["seed"] = cls.CLASSIFICATION_SEED
+        return compiled
+
+    def combine_output_columns(self, output_columns: Tuple[str, ...]) -> Dict[str, Any]:
+        """
+        Build the prompt and function definition that fill several output columns of a row at once.
+
+        Every output column becomes one property of a single 'fill_row' function, using the
+        column's own schema property if it has one. Built once per combination of columns.
+        """
+        combined = self._combined.get(output_columns)
+        if combined is not None:
+            return combined
+
+        properties = {}
+        for output_column in output_columns:
+            compiled = self._compiled[output_column]
+            if compiled["param_name"]:
+                properties[output_column] = compiled["schema"]["schema"]["properties"][compiled["param_name"]]
+            else:
+                properties[output_column] = {"type": "string"}
+
+        compiled_columns = [self._compiled[output_column] for output_column in output_columns]
+        input_columns = list(dict.fromkeys(
+            input_col
+            for output_column in output_columns
+            for input_col in self.output_columns[output_column].get('input_columns', [])
+        ))
+        combined = {
+            "prompt": "Produce the following fields:\n\n" + "\n\n".join(
+                f"{output_column}:\n{compiled['prompt']}"
+                for output_column, compiled in zip(output_columns, compiled_columns)
+            ),
+            "functions": [{
+                "name": "fill_row",
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(output_columns)
+                }
+            }],
+            "function_call": {"name": "fill_row"},
+            # Leave room for the JSON structure around every field
+            "max_tokens": sum(compiled["max_tokens"] + 20 for compiled in compiled_columns),
+            "max_tokens_cap": sum(
+                (compiled["max_tokens_cap"] or compiled["max_tokens"]) + 20 for compiled in compiled_columns
+            ),
+            # Only columns sharing a temperature are combined (see process_all)
+            "temperature": compiled_columns[0]["temperature"],
+            # Only a row made up entirely of classifications is reproducible as a whole
+            "seed": self.CLASSIFICATION_SEED if all(compiled["seed"] is not None for compiled in compiled_columns) else None,
+            "input_positions": [self._header_index[input_col] for input_col in input_columns],
+            "context_template": self.context_template(input_columns)
+        }
+        self._combined[output_columns] = combined
+        return combined
+
+    def extract_value(self, result: Any, output_column: str) -> Any:
+        compiled = self._compiled[output_column]
+        if isinstance(result, dict):
+            # When a schema is provided, extract its first parameter
+            if compiled["schema"]:
+                param_name = compiled["param_name"]
+                if param_name:
+                    value = result.get(param_name, 'N/A')
+                    logger.info("Extracted '%s': %s", param_name, value)
                 else:
-                    if cell_value is None:
-                        logger.debug(f"Row has no value for column '{column}'.")
-                        return False
-                    if not op_func(cell_value, value):
-                        return False
-            except Exception as e:
-                logger.error(f"Error applying filter on column '{column}': {e}")
-                return False
+                    # If no parameter names are specified, use the entire result
+                    value = result
+                    logger.info("No parameters specified in schema, using result: %s", value)
+            else:
+                # No schema, use the entire result
+                value = result
+                logger.info("No schema provided, using result: %s", value)
+        else:
+            # Handle free-form text outputs
+            value = result  # For free-form text outputs
+            logger.info("Free-form result: %s", value)
+        return value
+
+    def get_context(self, row_number: int, row_values: Tuple[Any, ...], output_column: str) -> str:
+        # Contexts are only precomputed when the parallel workers are enabled
+        context = self.row_contexts.get((row_number, output_column))
+        if context is None:
+            context = format_context(self._context_templates[output_column], row_values, self._input_positions[output_column])
+        return context
+
+    def build_contexts_parallel(self, rows: List[Tuple[int, Tuple[Any, ...]]]) -> Dict[Tuple[int, str], str]:
+        """
+        Precompute every row's contexts across 'parallel_workers' processes with pandarallel.
 
-            logger.debug(f"Filtering on column '{column}': {cell_value} {operation} {value}")
+        Only the CPU-bound prompt building runs in the workers; API calls stay on the event loop.
+        """
+        from pandarallel import pandarallel  # Optional dependency, only needed for parallel_workers
+
+        pandarallel.initialize(nb_workers=self.parallel_workers, progress_bar=False, verbose=0)
+        frame = pd.DataFrame(
+            [row_values for _, row_values in rows],
+            index=[row_number for row_number, _ in rows],
+            dtype=object
+        )
+        contexts = frame.parallel_apply(
+            partial(build_row_contexts, context_templates=self._context_templates, input_positions=self._input_positions),
+            axis=1
+        )
+        return {
+            (row_number, output_column): context
+            for row_number, column_contexts in contexts.items()
+            for output_column, context in column_contexts.items()
+        }
 
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with jitter, so concurrent retries do not fire in lockstep.
+        """
+        delay = min(self.retry_delay * (2 ** (attempt - 1)), 60)
+        return random.uniform(delay * 0.5, delay * 1.5)
+
+    def is_valid(self, value: Any, output_column: str, output_config: Dict[str, Any]) -> bool:
+        """
+        Check a generated value against the column's schema enum and 'validator' settings.
+        """
+        if value is None or value == '':
+            return False
+
+        allowed = self._compiled[output_column]["enum"]
+        if allowed and value not in allowed:
+            return False
+
+        validator = output_config.get('validator', {})
+        if 'allowed' in validator and value not in validator['allowed']:
+            return False
+        if 'max_length' in validator and len(str(value)) > validator['max_length']:
+            return False
+        if 'pattern' in validator and not re.fullmatch(validator['pattern'], str(value)):
+            return False
         return True
 
-    def process_row(self, row_number: int, row_data: pd.Series):
-        logger.info(f"Processing row {row_number}: {row_data.to_dict()}")
-        for output_column, output_config in self.output_columns.items():
-            prompt_template = output_config['prompt']
-            max_tokens = output_config.get('max_tokens', 50)
-            temperature = output_config.get('temperature', 0.7)
-            fetch_all = output_config.get('fetch_all', False)
-            schema = output_config.get('schema', None)
-            input_columns = output_config.get('input_columns', [])
-
-            # Determine whether to fetch based on 'fetch_all' and cell content
-            current_value = row_data.get(output_column, None)
-            should_fetch = fetch_all or (pd.isna(current_value) or str(current_value).strip() == '')
-
-            if not should_fetch:
-                logger.info(f"Skipping '{output_column}' for row {row_number} as it is already populated and 'fetch_all' is False.")
-                continue
+    async def fetch_column(self, row_number: int, row_values: Tuple[Any, ...], output_column: str, output_config: Dict[str, Any]) -> Optional[Any]:
+        """
+        Request the value of one output column for one row.
 
-            # Prepare the prompt by inserting input column values
-            prompt = prompt_template
-            for input_col in input_columns:
-                prompt += f"\n{input_col}: {row_data[input_col]}"
-            logger.debug(f"Generated prompt for '{output_column}': {prompt}")
-
-            # Prepare functions and function_call if schema is provided
-            functions = None
-            function_call = None
-            if schema:
-                function_name = schema.get('name', 'auto_generated_function')
-                function_schema = schema.get('schema')
-                functions = [{
-                    "name": function_name,
-                    "parameters": function_schema
-                }]
-                function_call = {"name": function_name}
-
-            # Retry logic
-            for attempt in range(1, self.retry_attempts + 1):
-                try:
-                    result = self.openai.create_completion(
-                        prompt=prompt,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        functions=functions,
-                        function_call=function_call
-                    )
-
-                    logger.info(f"Attempt {attempt}: Received response {result}")
-
-                    if result:
-                        if isinstance(result, dict):
-                            # When a schema is provided, extract the parameter names
-                            if schema:
-                                function_schema = schema.get('schema', {})
-                                parameter_names = function_schema.get('properties', {}).keys()
-                                # Assuming we're interested in the first parameter
-                                if parameter_names:
-                                    param_name = next(iter(parameter_names))
-                                    value = result.get(param_name, 'N/A')
-                                    logger.info(f"Extracted '{param_name}': {value}")
-                                else:
-                                    # If no parameter names are specified, use the entire result
-                                    value = result
-                                    logger.info(f"No parameters specified in schema, using result: {value}")
-                            else:
-                                # No schema, use the entire result
-                                value = result
-                                logger.info(f"No schema provided, using result: {value}")
-                        else:
-                            # Handle free-form text outputs
-                            value = result  # For free-form text outputs
-                            logger.info(f"Free-form result: {value}")
-
-                        # Write directly to the cell
-                        try:
-                            column_letter = self.get_column_letter(output_column)
-                            cell_reference = f"{column_letter}{row_number}"
-                            self.sheet[cell_reference].value = value
-                            logger.info(f" - {output_column} updated in cell {cell_reference}: {value}")
-                            break  # Exit retry loop on success
-                        except Exception as write_error:
-                            logger.error(f"Failed to write to cell {cell_reference}: {write_error}")
-                            break  # Break to avoid infinite retries
+        With a strong model configured, values from the default model that fail validation
+        are requested again from the strong model.
+        """
+        value = await self.request_value(row_number, row_values, output_column, output_config)
+        if not self.strong_model:
+            return value
+        return await self.promote_if_invalid(row_number, row_values, output_column, output_config, value)
+
+    async def promote_if_invalid(
+        self,
+        row_number: int,
+        row_values: Tuple[Any, ...],
+        output_column: str,
+        output_config: Dict[str, Any],
+        value: Any
+    ) -> Optional[Any]:
+        self.validated_values += 1
+        if self.is_valid(value, output_column, output_config):
+            return value
+
+        self.promoted_values += 1
+        logger.info("Value %r for '%s' in row %d failed validation; retrying with '%s'.", value, output_column, row_number, self.strong_model)
+        strong_value = await self.request_value(row_number, row_values, output_column, output_config, model=self.strong_model)
+        return strong_value if strong_value is not None else value
+
+    async def request_value(
+        self,
+        row_number: int,
+        row_values: Tuple[Any, ...],
+        output_column: str,
+        output_config: Dict[str, Any],
+        model: Optional[str] = None
+    ) -> Optional[Any]:
+        """
+        Request the value of one output column for one row, retrying on failure.
+        """
+        compiled = self._compiled[output_column]
+
+        # Keep the prompt template as-is and send the row's input values separately
+        context = self.get_context(row_number, row_values, output_column)
+        logger.debug("Generated prompt for '%s': %s\n%s", output_column, compiled['prompt'], context)
+
+        # Retry logic
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                result = await self.openai.create_completion(
+                    prompt=compiled["prompt"],
+                    max_tokens=compiled["max_tokens"],
+                    temperature=compiled["temperature"],
+                    functions=compiled["functions"],
+                    function_call=compiled["function_call"],
+                    context=context,
+                    max_tokens_cap=compiled["max_tokens_cap"],
+                    model=model,
+                    seed=compiled["seed"]
+                )
+
+                logger.info("Attempt %d: Received response %s", attempt, result)
+
+                if result:
+                    return self.extract_value(result, output_column)
+                logger.warning(f"Attempt {attempt}: Received an empty or invalid result for '{output_column}'.")
+
+            except BadRequestError as e:
+                # The request itself is invalid, so retrying cannot succeed
+                logger.error(f"Attempt {attempt} for '{output_column}' in row {row_number} was rejected: {e}. Not retrying.")
+                return None
+            except Exception as e:
+                if attempt == self.retry_attempts:
+                    logger.warning(f"Attempt {attempt} failed for '{output_column}' in row {row_number}. Error: {e}.")
+                    break
+                # Connection errors are usually transient, so retry them quickly
+                delay = 1 if isinstance(e, APIConnectionError) else self.backoff_delay(attempt)
+                logger.warning(f"Attempt {attempt} failed for '{output_column}' in row {row_number}. Error: {e}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+        logger.error(f"All retry attempts failed for '{output_column}' in row {row_number}.")
+        return None
+
+    async def fetch_column_batch(
+        self,
+        batch: List[Tuple[int, Tuple[Any, ...]]],
+        output_column: str,
+        output_config: Dict[str, Any]
+    ) -> Dict[int, Any]:
+        """
+        Request the value of one output column for several rows with a single API call.
+
+        The rows are sent as numbered blocks and the model is asked for a JSON object whose
+        'results' array holds one entry per row. If the response is malformed or does not
+        contain exactly one entry per row, the batch falls back to per-row requests.
+        """
+        if len(batch) == 1:
+            row_number, row_values = batch[0]
+            value = await self.fetch_column(row_number, row_values, output_column, output_config)
+            return {} if value is None else {row_number: value}
+
+        compiled = self._compiled[output_column]
+        prompt = (
+            f"{compiled['prompt']}\n\n"
+            f"Answer separately for each of the {len(batch)} numbered items that follow. "
+            f"Return a JSON object with a \"results\" key holding an array of {len(batch)} objects, "
+            f"one per item and in the same order. {compiled['batch_item_format']}"
+        )
+        context = "\n".join(
+            f"[{position}]\n" + self.get_context(row_number, row_values, output_column)
+            for position, (row_number, row_values) in enumerate(batch, start=1)
+        )
+        logger.debug("Generated batch prompt for '%s': %s\n%s", output_column, prompt, context)
+
+        # Leave room for the JSON structure around every item
+        max_tokens = (compiled["max_tokens"] + 20) * len(batch)
+        max_tokens_cap = compiled["max_tokens_cap"]
+        if max_tokens_cap:
+            max_tokens_cap = (max_tokens_cap + 20) * len(batch)
+        try:
+            content = await self.openai.create_completion(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=compiled["temperature"],
+                context=context,
+                response_format={"type": "json_object"},
+                max_tokens_cap=max_tokens_cap,
+                seed=compiled["seed"]
+            )
+            items = orjson.loads(content)["results"]
+            if not isinstance(items, list) or len(items) != len(batch):
+                raise ValueError(f"expected {len(batch)} results, got {len(items) if isinstance(items, list) else items!r}")
+            values = {}
+            for (row_number, _), item in zip(batch, items):
+                if not isinstance(item, dict):
+                    raise ValueError(f"result for row {row_number} is not an object: {item!r}")
+                value = self.extract_value(item, output_column) if compiled["schema"] else item.get('value')
+                if value is None or value == '':
+                    raise ValueError(f"result for row {row_number} is empty")
+                values[row_number] = value
+        except Exception as e:
+            logger.warning(f"Batch request for '{output_column}' failed ({e}). Falling back to per-row requests.")
+            values = {}
+            for row_number, row_values in batch:
+                value = await self.fetch_column(row_number, row_values, output_column, output_config)
+                if value is not None:
+                    values[row_number] = value
+            return values
+
+        if self.strong_model:
+            rows_by_number = dict(batch)
+            for row_number, value in list(values.items()):
+                values[row_number] = await self.promote_if_invalid(
+                    row_number, rows_by_number[row_number], output_column, output_config, value
+                )
+        return values
+
+    async def fetch_row_combined(self, row_number: int, row_values: Tuple[Any, ...], output_columns: List[str]) -> Dict[str, Any]:
+        """
+        Request several output columns of one row with a single function call.
+
+        Columns missing from the response, or all of them if the request fails, fall back
+        to per-column requests.
+        """
+        combined = self.combine_output_columns(tuple(output_columns))
+        context = format_context(combined["context_template"], row_values, combined["input_positions"])
+        logger.debug("Generated combined prompt for row %d: %s\n%s", row_number, combined["prompt"], context)
+
+        values = {}
+        try:
+            result = await self.openai.create_completion(
+                prompt=combined["prompt"],
+                max_tokens=combined["max_tokens"],
+                temperature=combined["temperature"],
+                functions=combined["functions"],
+                function_call=combined["function_call"],
+                context=context,
+                max_tokens_cap=combined["max_tokens_cap"],
+                seed=combined["seed"]
+            )
+            if not isinstance(result, dict):
+                raise ValueError(f"expected an object, got {result!r}")
+            for output_column in output_columns:
+                value = result.get(output_column)
+                if value is not None and value != '':
+                    values[output_column] = value
+            logger.info("Combined response for row %d: %s", row_number, values)
+        except Exception as e:
+            logger.warning(f"Combined request for row {row_number} failed ({e}). Falling back to per-column requests.")
+
+        for output_column in output_columns:
+            output_config = self.output_columns[output_column]
+            if output_column not in values:
+                value = await self.fetch_column(row_number, row_values, output_column, output_config)
+                if value is not None:
+                    values[output_column] = value
+            elif self.strong_model:
+                values[output_column] = await self.promote_if_invalid(
+                    row_number, row_values, output_column, output_config, values[output_column]
+                )
+        return values
+
+    def log_row(self, row_number: int, row_values: Tuple[Any, ...]):
+        # Skip building the dict entirely unless INFO records are emitted
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Processing row %d: %s", row_number, {c: row_values[self._header_index[c]] for c in self.input_columns})
+
+    def complete_rows(self, rows_done: int, results: Dict[Tuple[int, str], Any]):
+        """
+        Record finished rows and save a checkpoint every 'checkpoint_interval' rows.
+
+        Tasks all run on the event loop thread, so writing to the workbook here is safe.
+        """
+        self.pending_results.update(results)
+        if not rows_done:
+            return  # A cell finished but its row is still in progress
+        self.completed_rows += rows_done
+        percent_complete = (self.completed_rows / self.total_rows) * 100
+        print(f"Progress: {self.completed_rows}/{self.total_rows} rows ({percent_complete:.2f}%)", end='\r')
+
+        if self.checkpoint_interval and self.completed_rows // self.checkpoint_interval > self.checkpoints_saved:
+            self.checkpoints_saved = self.completed_rows // self.checkpoint_interval
+            self.flush_results()
+            self.save()
+            logger.info(f"Checkpoint saved after {self.completed_rows} rows.")
+
+    def flush_results(self):
+        self.write_results(self.pending_results)
+        self.pending_results = {}
+
+    async def process_cell_async(self, row_number: int, row_values: Tuple[Any, ...], output_column: str,
+                                 output_config: Dict[str, Any]) -> Dict[Tuple[int, str], Any]:
+        """
+        Generate the output value for a single (row, output column) job.
+
+        Returns a mapping of (row_number, output_column) to value; cells are not written here
+        but collected by complete_rows, so workbook mutation stays in a single place. A row
+        counts as completed once the last of its jobs has finished.
+        """
+        async with self.semaphore:
+            value = await self.fetch_column(row_number, row_values, output_column, output_config)
+
+        cell_results = {} if value is None else {(row_number, output_column): value}
+        self.jobs_left[row_number] -= 1
+        self.complete_rows(1 if self.jobs_left[row_number] == 0 else 0, cell_results)
+        return cell_results
+
+    async def process_row_combined_async(self, row_number: int, row_values: Tuple[Any, ...],
+                                         output_columns: List[str]) -> Dict[Tuple[int, str], Any]:
+        """
+        Generate several output values of a single row with one combined request.
+
+        A row counts as completed once the last of its jobs has finished.
+        """
+        async with self.semaphore:
+            values = await self.fetch_row_combined(row_number, row_values, output_columns)
+
+        row_results = {(row_number, output_column): value for output_column, value in values.items()}
+        self.jobs_left[row_number] -= 1
+        self.complete_rows(1 if self.jobs_left[row_number] == 0 else 0, row_results)
+        return row_results
+
+    async def process_batch_async(self, batch: List[Tuple[int, Tuple[Any, ...]]]) -> Dict[Tuple[int, str], Any]:
+        """
+        Generate the output values for a batch of rows, one request per output column.
+        """
+        batch_results = {}
+        async with self.semaphore:
+            for row_number, row_values in batch:
+                self.log_row(row_number, row_values)
+            for output_column, output_config in self.output_columns.items():
+                pending = [
+                    (row_number, row_values) for row_number, row_values in batch
+                    if self.should_fetch(row_number, output_column)
+                ]
+                if not pending:
+                    continue
+                values = await self.fetch_column_batch(pending, output_column, output_config)
+                for row_number, value in values.items():
+                    batch_results[(row_number, output_column)] = value
+
+        self.complete_rows(len(batch), batch_results)
+        return batch_results
+
+    async def process_all(self, rows: List[Tuple[int, Tuple[Any, ...]]]):
+        """
+        Dispatch every (row, output column) job (or combined row, or batch of rows) concurrently,
+        bounded by 'max_concurrency' in-flight tasks.
+
+        Results are collected in 'pending_results', keyed by (row_number, output_column),
+        until the next checkpoint or the final save writes them.
+        """
+        # The semaphore must be created inside the running event loop
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.total_rows = len(rows)
+        self.completed_rows = 0
+        self.checkpoints_saved = 0
+
+        if self.batch_size > 1:
+            batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+            tasks = [self.process_batch_async(batch) for batch in batches]
+            labels = [f"rows {batch[0][0]}-{batch[-1][0]}" for batch in batches]
+        else:
+            tasks, labels = [], []
+            self.jobs_left = {}
+            for row_number, row_values in rows:
+                self.log_row(row_number, row_values)
+                output_columns = [
+                    output_column for output_column in self.output_columns
+                    if self.should_fetch(row_number, output_column)
+                ]
+
+                # Combine columns that share a temperature, so none is sampled differently than configured
+                groups = [[output_column] for output_column in output_columns]
+                if self.combine_columns:
+                    by_temperature = {}
+                    for output_column in output_columns:
+                        by_temperature.setdefault(self._compiled[output_column]["temperature"], []).append(output_column)
+                    groups = list(by_temperature.values())
+
+                self.jobs_left[row_number] = len(groups)
+                for group in groups:
+                    if len(group) > 1:
+                        tasks.append(self.process_row_combined_async(row_number, row_values, group))
+                        labels.append(f"columns {group} in row {row_number}")
                     else:
-                        logger.warning(f"Attempt {attempt}: Received an empty or invalid result for '{output_column}'.")
+                        tasks.append(self.process_cell_async(row_number, row_values, group[0], self.output_columns[group[0]]))
+                        labels.append(f"column '{group[0]}' in row {row_number}")
+        try:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            # Connections are bound to this event loop, so release them before it closes
+            await self.openai.close()
 
-                except Exception as e:
-                    logger.warning(f"Attempt {attempt} failed for '{output_column}' in row {row_number}. Error: {e}. Retrying in {self.retry_delay} seconds...")
-                    time.sleep(self.retry_delay)
+        if self.openai.deduplicated_requests:
+            logger.info(f"{self.openai.deduplicated_requests} duplicate requests shared the response of an identical request.")
+        if self.openai.semantic_cache is not None and self.openai.semantic_cache.hits:
+            logger.info(f"{self.openai.semantic_cache.hits} requests were answered by the semantic cache.")
+        if self.strong_model and self.validated_values:
+            promotion_rate = (self.promoted_values / self.validated_values) * 100
+            logger.info(f"Promoted {self.promoted_values} of {self.validated_values} values to '{self.strong_model}' ({promotion_rate:.2f}%).")
 
-            else:
-                logger.error(f"All retry attempts failed for '{output_column}' in row {row_number}.")
+        for label, outcome in zip(labels, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Processing failed for {label}: {outcome}")
 
-            # Sleep between API requests to respect rate limits
-            time.sleep(self.sleep_time)
+    def write_results(self, results: Dict[Tuple[int, str], Any]):
+        """
+        Write the collected results column by column.
 
+        A separate output file gets each column assigned to the DataFrame in one go;
+        in-place updates resolve the column letter once per column.
+        """
+        column_results = {}
+        for (row_number, output_column), value in results.items():
+            column_results.setdefault(output_column, {})[row_number] = value
+
+        for output_column, values in column_results.items():
+            if self.output_path:
+                if output_column not in self.df.columns:
+                    logger.error(f"Failed to write '{output_column}': Column '{output_column}' not found in the Excel sheet.")
+                    continue
+                column_values = self.df[output_column].tolist()
+                for row_number, value in values.items():
+                    column_values[row_number - 2] = value
+                    logger.info(" - %s updated for row %d: %s", output_column, row_number, value)
+                self.df[output_column] = pd.Series(column_values, index=self.df.index, dtype=object)
+                continue
+
+            try:
+                column_letter = self.get_column_letter(output_column)
+            except ValueError as e:
+                logger.error(f"Failed to write '{output_column}': {e}")
+                continue
+            self.open_workbook()
+            for row_number, value in values.items():
+                cell_reference = f"{column_letter}{row_number}"
+                try:
+                    self.sheet[cell_reference].value = value
+                    logger.info(" - %s updated in cell %s: %s", output_column, cell_reference, value)
+                except Exception as write_error:
+                    logger.error(f"Failed to write to cell {cell_reference}: {write_error}")
 
     def get_column_letter(self, column_name: str) -> str:
-        for idx, cell in enumerate(self.sheet[1], start=1):
-            if cell.value == column_name:
-                return cell.column_letter
-        raise ValueError(f"Column '{column_name}' not found in the Excel sheet.")
+        try:
+            return self._col_letters[column_name]
+        except KeyError:
+            raise ValueError(f"Column '{column_name}' not found in the Excel sheet.") from None
 
     def process_excel(self):
         try:
-            total_rows = self.sheet.max_row - 1  # Exclude header row
-            current_row = 0
-            processed_rows = 0
-            print("Processing rows...")
-            for idx, row in enumerate(self.sheet.iter_rows(min_row=2, values_only=True), start=2):
-                row_data = pd.Series(row, index=[cell.value for cell in self.sheet[1]])
+            # Only rows with at least one output still to fetch enter the loop
+            self.fetch_masks = self.build_fetch_masks()
+            needs_fetch = reduce(operator.or_, self.fetch_masks.values(), pd.Series(False, index=self.df.index))
+            logger.info(f"{int(needs_fetch.sum())} of {len(self.df)} rows have outputs to fetch.")
 
-                # Check if the row matches the filter criteria
-                if self.matches_criteria(row_data):
-                    self.process_row(idx, row_data)
-                    processed_rows += 1
-                else:
-                    logger.debug(f"Row {idx} skipped due to filter criteria.")
+            # Check which rows match the filter criteria
+            if self.filter_enabled:
+                matches_filter = self.build_filter_mask()
+                logger.info(f"{int((needs_fetch & matches_filter).sum())} of them match the filter criteria.")
+                needs_fetch &= matches_filter
+            pending = self.df[needs_fetch]
+
+            # Row 1 holds the headers
+            rows = [
+                (df_index + 2, values)
+                for df_index, values in zip(pending.index, pending.itertuples(index=False, name=None))
+            ]
+
+            if rows and self.parallel_workers:
+                self.row_contexts = self.build_contexts_parallel(rows)
 
-                current_row += 1
-                percent_complete = (current_row / total_rows) * 100
-                print(f"Progress: {current_row}/{total_rows} rows ({percent_complete:.2f}%)", end='\r')
+            print("Processing rows...")
+            if rows:
+                asyncio.run(self.process_all(rows))
+        except KeyboardInterrupt:
+            logger.warning("Processing interrupted. Saving the results collected so far.")
+            raise
         except Exception as e:
             logger.error(f"Error processing Excel file: {e}")
             raise
         finally:
-            # Save the workbook after processing all rows
-            self.save_workbook()
+            # Write the results since the last checkpoint and save the workbook
+            self.flush_results()
+            self.save()
             print("\nProcessing complete.")
 
 # ---------------------------- Main Execution ---------------------------- #
@@ -337,6 +1520,9 @@ def main():
     # Adjust the input_path to be absolute
     excel_input_path = project_dir / config['excel']['input_path']
     config['excel']['input_path'] = str(excel_input_path.resolve())
+    if config['excel'].get('output_path'):
+        excel_output_path = project_dir / config['excel']['output_path']
+        config['excel']['output_path'] = str(excel_output_path.resolve())
 
     # Retrieve OpenAI API key environment variable name from configuration
     api_key_env_var = config['openai']['api_key_env_var']
@@ -346,17 +1532,54 @@ def main():
         return
 
     # Retrieve OpenAI model and system message from configuration
-    model = config['openai'].get('model', 'gpt-4o-mini')
+    model = config['openai'].get('models', {}).get('cheap') or config['openai'].get('model', 'gpt-4o-mini')
     system_message = config['openai'].get('system_message', "You are a helpful assistant that adheres to user requests.")
 
+    # Initialize the rate limiter from the account's per-minute limits
+    rate_limiter = RateLimiter(
+        max_requests_per_minute=config['processing'].get('max_requests_per_minute', 500),
+        max_tokens_per_minute=config['processing'].get('max_tokens_per_minute', 200000)
+    )
+
+    # Open the response cache unless it is disabled
+    cache = None
+    cache_config = config.get('cache', {})
+    if cache_config.get('enabled', True):
+        cache_path = (project_dir / cache_config.get('path', '.cache/openai_cache')).resolve()
+        cache = diskcache.Cache(str(cache_path), size_limit=2**31)
+        logger.info(f"Response cache opened at '{cache_path}' with {len(cache)} entries.")
+
+    # Open the semantic cache if it is enabled
+    semantic_cache = None
+    semantic_config = cache_config.get('semantic', {})
+    if semantic_config.get('enabled', False):
+        semantic_cache = SemanticCache(
+            path=(project_dir / semantic_config.get('path', '.cache/semantic_cache')).resolve(),
+            threshold=semantic_config.get('threshold', 0.93),
+            model=semantic_config.get('model', 'text-embedding-3-small')
+        )
+
     # Initialize OpenAI client
-    openai_client = OpenAIClient(api_key=api_key, model=model, system_message=system_message)
+    openai_client = OpenAIClient(
+        api_key=api_key,
+        model=model,
+        system_message=system_message,
+        rate_limiter=rate_limiter,
+        cache=cache,
+        context_window=config['openai'].get('context_window'),
+        cache_sampled=cache_config.get('cache_sampled', False),
+        semantic_cache=semantic_cache
+    )
 
     # Initialize Excel processor
     processor = ExcelProcessor(config=config, openai_client=openai_client)
 
-    # Process Excel file
-    processor.process_excel()
+    # Process Excel file; an interrupted run saves what it has, so it can simply be restarted
+    try:
+        processor.process_excel()
+    except KeyboardInterrupt:
+        print("Interrupted. The results collected so far were saved; run again to resume.")
+        sys.exit(130)
 
     logger.info("Excel processing completed successfully.\nExiting...")
 